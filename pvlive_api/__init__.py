@@ -1,8 +1,3 @@
-try:
-    #py2
-    from pvlive import PVLive
-except:
-    #py3+
-    from pvlive_api.pvlive import PVLive
+from pvlive_api.pvlive import PVLive
 
 __all__ = ["PVLive"]
@@ -7,26 +7,93 @@ A Python interface for the PV_Live web API from Sheffield Solar.
 - Updated: 2020-10-20 to return Pandas dataframe object
 """
 
-from __future__ import print_function
-import json
+import os
+import sys
+import asyncio
 from datetime import datetime, timedelta, date, time
 from time import sleep
+import random
+from collections import OrderedDict
+from contextlib import closing
+from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import pytz
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# Incremental parsing only pays off with a compiled ijson backend, and is still slower than orjson
+STREAM_PARSING = ijson is not None and orjson is None and \
+    getattr(ijson, "backend", "python") != "python"
+# urllib3 can only decode brotli responses if one of these packages is installed
+if find_spec("brotli") is not None or find_spec("brotlicffi") is not None:
+    ACCEPT_ENCODING = "gzip, deflate, br"
+else:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+__version__ = "0.4"
+
+# The dtype (and hence resolution, which varies between Pandas versions) of parsed API timestamps
+_DATETIME_DTYPE = pd.to_datetime(["1970-01-01T00:00:00Z"], utc=True).dtype
 
 class PVLiveException(Exception):
     """An Exception specific to the PVLive class."""
     def __init__(self, msg):
         try:
-            caller_file = inspect.stack()[2][1]
-        except:
-            import os
+            caller_file = os.path.basename(sys._getframe(2).f_code.co_filename)
+        except (AttributeError, ValueError):
             caller_file = os.path.basename(__file__)
         self.msg = "%s (in '%s')" % (msg, caller_file)
     def __str__(self):
         return self.msg
 
+class _LRUCache(object):
+    """
+    A small thread-safe mapping which discards the least recently used entries when it holds more
+    than a given number of entries or total weight (e.g. number of rows).
+    """
+    def __init__(self):
+        self._data = OrderedDict()
+        self._weight = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for *key* (marking it as recently used), or *default*."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value, weight, maxsize, maxweight):
+        """
+        Store *value* under *key*, evicting the least recently used entries until at most *maxsize*
+        entries with a total weight of at most *maxweight* remain. Values heavier than *maxweight*
+        are not stored at all.
+        """
+        with self._lock:
+            if key in self._data:
+                self._weight -= self._data.pop(key)[1]
+            if weight > maxweight:
+                return
+            self._data[key] = (value, weight)
+            self._weight += weight
+            while len(self._data) > maxsize or self._weight > maxweight:
+                self._weight -= self._data.popitem(last=False)[1][1]
+
 class PVLive:
     """
     Interface with the PV_Live web API.
@@ -34,13 +101,67 @@ class PVLive:
     Parameters
     ----------
     `retries` : int
-        Optionally specify the number of retries to use should the API respond with anything
-        other than status code 200. Exponential back-off applies inbetween retries.
+        Optionally specify the number of retries to use should the API respond with a server
+        error (5xx) or rate limit (429), or the request time out or fail to connect. Exponential
+        back-off applies inbetween retries.
+
+    Notes
+    -----
+    A single HTTP session is re-used for all requests so that connections to the API are kept
+    alive between calls. Call `close()` when finished, or use the class as a context manager
+    e.g. `with PVLive() as pvl:`.
+
+    Responses are cached in memory: results whose interval ended more than 24 hours ago (which
+    are final) in a history cache, and other results alongside their ETag / Last-Modified
+    validators for conditional GETs. The attributes `history_cache_size` (default 1024) and
+    `etag_cache_size` (default 512) bound the number of entries in each, and `cache_max_rows`
+    (default 100000) bounds the total number of result rows held by each.
+
+    If `ijson` (>= 3.1, with a compiled backend) is installed and `orjson` is not, `between()`
+    parses the responses for chunks longer than the attribute `stream_min_range` (default 7
+    days) incrementally as they are downloaded, rather than reading each body in full first.
     """
     def __init__(self, retries=3):
         self.base_url = "https://api0.solar.sheffield.ac.uk/pvlive/v2/pes"
         self.max_range = {"national": timedelta(days=365), "regional": timedelta(days=30)}
         self.retries = retries
+        self.max_delay = 30
+        self.stream_min_range = timedelta(days=7)
+        self._meta_cache = {}
+        # Enough to poll the latest result for every PES region (0-327) without evictions
+        self.etag_cache_size = 512
+        self.history_cache_size = 1024
+        self.cache_max_rows = 100000
+        self._etag_cache = _LRUCache()
+        self._history_cache = _LRUCache()
+        self.timeout = (3.05, 30)
+        self._session = requests.Session()
+        self.pool_maxsize = 0
+        self._mount_adapter(16)
+        self._session.headers.update({
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Connection": "keep-alive",
+            "User-Agent": "pvlive-api/{}".format(__version__),
+        })
+
+    def _mount_adapter(self, pool_maxsize):
+        """Mount a connection-pooling adapter holding up to *pool_maxsize* connections per host."""
+        old_adapter = self._session.adapters.get("https://")
+        self._session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize,
+                                                    max_retries=0))
+        self.pool_maxsize = pool_maxsize
+        if old_adapter is not None:
+            old_adapter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the underlying HTTP session and release any pooled connections."""
+        self._session.close()
 
     def latest(self, pes_id=0, data_frame=False, extra_fields=""):
         """
@@ -74,14 +195,52 @@ class PVLive:
             raise PVLiveException("The pes_id must be an integer between 0 and 327 (inclusive).")
         if not isinstance(extra_fields, str):
             raise PVLiveException("The extra_fields must be a comma-separated string.")
-        params = self._compile_params(extra_fields)
+        params = self._params_none(extra_fields)
         response = self._query_api(pes_id, params)
         if response["data"]:
             if data_frame:
-                return self.convert_tuple_to_df(response["data"][0], response['meta'])
+                columns = self._meta(pes_id, extra_fields)
+                return self.convert_tuple_to_df(response["data"][0], columns)
             return tuple(response["data"][0])
         return (None, None, None)
 
+    def latest_many(self, pes_ids, extra_fields="", max_workers=16):
+        """
+        Get the latest PV_Live generation results for several PES regions from the API, querying
+        the regions concurrently.
+
+        Parameters
+        ----------
+        `pes_ids` : iterable of int
+            The numerical IDs of the PES regions of interest.
+        `extra_fields` : string
+            Comma-separated string listing of the names of any extra fields required.
+        `max_workers` : int
+            The maximum number of requests to have in flight at once. Defaults to 16. The
+            connection pool is enlarged to match if it is smaller than this.
+        Returns
+        -------
+        dataframe
+            Each row of the dataframe contains the columns pes_id, datetime_GMT and generation_MW
+            fields of the latest PV_Live result for one region, plus any extra_fields in the order
+            specified. Regions without a result are omitted.
+        Notes
+        -----
+        For list of optional *extra_fields*, see `PV_Live API Docs
+        <https://www.solar.sheffield.ac.uk/pvlive/api/>`_.
+        """
+        pes_ids = list(pes_ids)
+        if not pes_ids:
+            return self._records_to_df([], self._meta_cache.get(extra_fields, []))
+        if max_workers > self.pool_maxsize:
+            self._mount_adapter(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda pes_id: self.latest(pes_id,
+                                                                   extra_fields=extra_fields),
+                                        pes_ids))
+        data = [row for row in results if row[0] is not None]
+        return self._records_to_df(data, self._meta(pes_ids[0], extra_fields))
+
     def at_time(self, dt, pes_id=0, data_frame=False, extra_fields=""):
         """
         Get the PV_Live generation result for a given time from the API.
@@ -114,13 +273,14 @@ class PVLive:
         <https://www.solar.sheffield.ac.uk/pvlive/api/>`_.
         """
         if not isinstance(dt, datetime) or dt.tzinfo is None:
-            PVLiveException("The dt must be a timezone-aware Python datetime object.")
+            raise PVLiveException("The dt must be a timezone-aware Python datetime object.")
         dt = self._nearest_hh(dt)
-        params = self._compile_params(extra_fields, dt)
+        params = self._params_at(extra_fields, dt)
         response = self._query_api(pes_id, params)
         if response["data"]:
             if data_frame:
-                return self.convert_tuple_to_df(response["data"][0], response['meta'])
+                columns = self._meta(pes_id, extra_fields)
+                return self.convert_tuple_to_df(response["data"][0], columns)
             return tuple(response["data"][0])
         return (None, None, None)
 
@@ -157,25 +317,61 @@ class PVLive:
         -----
         For list of optional *extra_fields*, see `PV_Live API Docs
         <https://www.solar.sheffield.ac.uk/pvlive/api/>`_.
+
+        Intervals no longer than the API's maximum range (`self.max_range`) are fetched in a single
+        request; longer intervals are split into consecutive requests of that length.
         """
-        type_check = not (isinstance(start, datetime) and isinstance(end, datetime))
-        tz_check = start.tzinfo is None or end.tzinfo is None
-        if type_check or tz_check:
-            PVLiveException("Start and end must be timezone-aware Python datetime objects.")
+        if not self._is_aware_interval(start, end):
+            raise PVLiveException("Start and end must be timezone-aware Python datetime objects.")
         start = self._nearest_hh(start)
         end = self._nearest_hh(end)
         data = []
-        request_start = start
-        max_range = self.max_range["national"] if pes_id == 0 else self.max_range["regional"]
-        while request_start < end:
-            request_end = min(end, request_start + max_range)
-            params = self._compile_params(extra_fields, request_start, request_end)
-            response = self._query_api(pes_id, params)
-            data += response["data"]
-            request_start += max_range + timedelta(minutes=30)
+        chunks = self._chunk_ranges(start, end, pes_id)
+        for request_start, request_end in chunks:
+            params = self._params_range(extra_fields, request_start, request_end)
+            # Long intervals can return several MB of JSON; parse them incrementally if possible
+            stream = STREAM_PARSING and request_end - request_start > self.stream_min_range
+            response = self._query_api(pes_id, params, stream=stream)
+            data.extend(response["data"])
+        if data_frame:
+            data = self._records_to_df(data, self._meta(pes_id, extra_fields))
+        return data
+
+    async def between_async(self, start, end, pes_id=0, data_frame=False, extra_fields=""):
+        """
+        Get the PV_Live generation result for a given time interval from the API, requesting
+        all chunks of the interval concurrently.
+
+        Requires the optional `aiohttp` dependency. Takes the same parameters and returns the
+        same results as `between()`, but must be awaited e.g.
+        `asyncio.run(pvl.between_async(start, end))`. Requests use the same headers, timeout,
+        retry policy and history cache as `between()`, but a separate aiohttp connection pool.
+        """
+        if aiohttp is None:
+            raise PVLiveException("The aiohttp package is required for between_async().")
+        if not self._is_aware_interval(start, end):
+            raise PVLiveException("Start and end must be timezone-aware Python datetime objects.")
+        start = self._nearest_hh(start)
+        end = self._nearest_hh(end)
+        url = self._pes_url(pes_id)
+        chunk_params = [self._params_range(extra_fields, chunk_start, chunk_end)
+                        for chunk_start, chunk_end in self._chunk_ranges(start, end, pes_id)]
+        connect_timeout, read_timeout = self.timeout if isinstance(self.timeout, tuple) \
+            else (self.timeout, self.timeout)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        connector = aiohttp.TCPConnector(limit_per_host=8)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers=dict(self._session.headers)) as session:
+            responses = await asyncio.gather(*[self._query_api_async(session, url, pes_id, params)
+                                               for params in chunk_params])
+            if data_frame and extra_fields not in self._meta_cache:
+                # Look up the schema here rather than via the blocking requests session
+                await self._query_api_async(session, url, pes_id, self._params_none(extra_fields))
+        data = []
+        for response in responses:
+            data.extend(response["data"])
         if data_frame:
-            columns = response['meta']
-            data = pd.DataFrame(data, columns=columns)
+            data = self._records_to_df(data, self._meta(pes_id, extra_fields))
         return data
 
     def day_peak(self, d, pes_id=0, data_frame=False, extra_fields=""):
@@ -209,16 +405,17 @@ class PVLive:
         <https://www.solar.sheffield.ac.uk/pvlive/api/>`_.
         """
         if not isinstance(d, date):
-            PVLiveException("The d must be a Python date object.")
+            raise PVLiveException("The d must be a Python date object.")
         start = datetime.combine(d, time(0, 30, tzinfo=pytz.UTC))
         end = start + timedelta(days=1) - timedelta(minutes=30)
-        params = self._compile_params(extra_fields, start, end)
+        params = self._params_range(extra_fields, start, end)
         response = self._query_api(pes_id, params)
         if response["data"]:
-            gens = [x[2] if x[2] is not None else -1e308 for x in response["data"]]
-            index_max = max(range(len(gens)), key=gens.__getitem__)
+            gens = self._generation_array(response["data"])
+            index_max = 0 if np.isnan(gens).all() else int(np.nanargmax(gens))
             if data_frame:
-                return self.convert_tuple_to_df(response["data"][index_max], response['meta'])
+                columns = self._meta(pes_id, extra_fields)
+                return self.convert_tuple_to_df(response["data"][index_max], columns)
             return tuple(response["data"][index_max])
         return (None, None, None)
 
@@ -242,76 +439,274 @@ class PVLive:
         <https://www.solar.sheffield.ac.uk/pvlive/api/>`_.
         """
         if not isinstance(d, date):
-            PVLiveException("The d must be a Python date object.")
+            raise PVLiveException("The d must be a Python date object.")
         start = datetime.combine(d, time(0, 30, tzinfo=pytz.UTC))
         end = start + timedelta(days=1) - timedelta(minutes=30)
-        params = self._compile_params("", start, end)
+        params = self._params_range("", start, end)
         response = self._query_api(pes_id, params)
         if response["data"]:
-            pv_energy = sum([x[2] if x[2] is not None else 0 for x in response["data"]]) * 0.5
+            pv_energy = float(np.nansum(self._generation_array(response["data"]))) * 0.5
             return pv_energy
         return None
 
-    def _compile_params(self, extra_fields="", start=None, end=None):
-        """Compile parameters into a Python dict, formatting where necessary."""
-        params = {}
+    def _generation_array(self, data):
+        """Extract the generation_MW column of some API data as a float array (None -> NaN)."""
+        return np.array([x[2] if x[2] is not None else np.nan for x in data], dtype=np.float64)
+
+    def _params_none(self, extra_fields=""):
+        """Compile the parameters for a query of the latest result into a Python dict."""
+        return {"extra_fields": extra_fields} if extra_fields else {}
+
+    def _params_at(self, extra_fields, dt):
+        """Compile the parameters for a query of a single time into a Python dict."""
+        dt_iso = self._format_dt(dt)
+        return self._params_iso(extra_fields, dt_iso, dt_iso)
+
+    def _params_range(self, extra_fields, start, end):
+        """Compile the parameters for a query of a time interval into a Python dict."""
+        return self._params_iso(extra_fields, self._format_dt(start), self._format_dt(end))
+
+    def _params_iso(self, extra_fields, start_iso, end_iso):
+        """Build the parameters dict from pre-formatted start and end strings."""
         if extra_fields:
-            params["extra_fields"] = extra_fields
-        if start is not None:
-            params["start"] = start.isoformat().replace('+00:00', 'Z')
-        end = start if (start is not None and end is None) else end
-        if end is not None:
-            params["end"] = end.isoformat().replace('+00:00', 'Z')
-        return params
-
-    def _query_api(self, pes_id, params):
-        """Query the API with some REST parameters."""
-        url = self._build_url(pes_id, params)
-        # print(url)
-        return self._fetch_url(url)
+            return {"extra_fields": extra_fields, "start": start_iso, "end": end_iso}
+        return {"start": start_iso, "end": end_iso}
+
+    def _format_dt(self, dt):
+        """Format a timezone-aware datetime as an ISO 8601 UTC string for the API."""
+        return dt.astimezone(pytz.UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def _query_api(self, pes_id, params, stream=False):
+        """
+        Query the API with some REST parameters. See `_fetch_url()` for *stream*.
+
+        Results for intervals ending more than 24 hours ago are considered final and are served
+        from an in-memory LRU cache on repeated queries.
+        """
+        cache_key = self._history_key(pes_id, params)
+        if cache_key is not None:
+            response = self._history_cache.get(cache_key)
+            if response is not None:
+                return self._copy_response(response)
+        # Finalised results never change, so there is no point also caching them for ETags
+        response = self._fetch_url(self._pes_url(pes_id), params, stream,
+                                   conditional=cache_key is None)
+        if "meta" in response:
+            self._meta_cache.setdefault(params.get("extra_fields", ""), response["meta"])
+        if cache_key is not None:
+            self._cache_history(cache_key, response)
+            return self._copy_response(response)
+        return response
+
+    def _cache_history(self, cache_key, response):
+        """Store a finalised response in the history cache."""
+        self._history_cache.put(cache_key, response, len(response["data"]),
+                                self.history_cache_size, self.cache_max_rows)
+
+    def _copy_response(self, response):
+        """Copy a cached response so that callers cannot modify the cached rows."""
+        return dict(response, data=[list(row) for row in response["data"]])
+
+    def _history_key(self, pes_id, params):
+        """Get the history cache key for a query of finalised results, or None if not final."""
+        cutoff = self._format_dt(datetime.now(pytz.UTC) - timedelta(hours=24))
+        if "end" in params and params["end"] < cutoff:
+            return (pes_id, frozenset(params.items()))
+        return None
+
+    def _meta(self, pes_id, extra_fields=""):
+        """
+        Get the column names returned by the API for a given set of extra_fields, querying the
+        latest result only if they have not already been seen in a previous response.
+        """
+        if extra_fields not in self._meta_cache:
+            self._query_api(pes_id, self._params_none(extra_fields))
+        return self._meta_cache[extra_fields]
 
     def convert_tuple_to_df(self, data, columns):
         """Converts a tuple of values to a data-frame object."""
-        df = pd.DataFrame([data], columns=columns)
+        df = self._records_to_df([data], columns)
         return df
 
-    def _build_url(self, pes_id, params):
-        """Construct the appropriate URL for a given set of parameters."""
-        base_url = "{}/{}".format(self.base_url, pes_id)
-        url = base_url + "?" + "&".join(["{}={}".format(k, params[k]) for k in params])
-        return url
+    def _records_to_df(self, data, columns):
+        """
+        Convert a list of API result rows to a data-frame object, building each column as a single
+        array rather than letting Pandas infer types cell-by-cell.
+        """
+        if not data:
+            return self._empty_df(columns)
+        frame = {}
+        for name, col in zip(columns, zip(*data)):
+            if name.lower() == "datetime_gmt":
+                frame[name] = pd.to_datetime(list(col), utc=True, cache=True)
+                continue
+            arr = np.asarray(col)
+            if arr.dtype == object:
+                # Numeric columns containing nulls come back as None
+                try:
+                    arr = arr.astype(np.float64)
+                except (TypeError, ValueError):
+                    pass
+            elif arr.dtype.kind == "U":
+                arr = arr.astype(object)
+            frame[name] = arr
+        return pd.DataFrame(frame, columns=columns)
+
+    def _empty_df(self, columns):
+        """
+        Create an empty data-frame object with the same column dtypes as `_records_to_df()` gives
+        for typical (non-empty) results.
+        """
+        frame = {}
+        for name in columns:
+            if name.lower() == "datetime_gmt":
+                frame[name] = pd.DatetimeIndex([], dtype=_DATETIME_DTYPE)
+            elif name.lower() == "pes_id":
+                frame[name] = np.array([], dtype=np.int64)
+            else:
+                frame[name] = np.array([], dtype=np.float64)
+        return pd.DataFrame(frame, columns=columns)
+
+    def _pes_url(self, pes_id):
+        """Construct the appropriate URL for a given PES region (without query parameters)."""
+        return "{}/{}".format(self.base_url, pes_id)
 
-    def _fetch_url(self, url):
-        """Fetch the URL with GET request."""
-        success = False
-        try_counter = 0
+    def _fetch_url(self, url, params=None, stream=False, conditional=True):
+        """
+        Fetch the URL with GET request, retrying up to `self.retries` times if the API responds
+        with a recoverable error (see `_is_retryable()`), times out or cannot be reached.
+
+        With *stream* (requires `ijson`), the response body is parsed incrementally as it is read
+        rather than being downloaded in full first. Only *conditional* requests are sent as, and
+        cached for, conditional GETs.
+        """
+        cache_key = (url, tuple(sorted((params or {}).items())))
+        cached = self._etag_cache.get(cache_key) if conditional else None
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
         delay = 1
-        while not success and try_counter < self.retries + 1:
-            # print(try_counter)
-            try_counter += 1
+        for try_counter in range(self.retries + 1):
             try:
-                page = requests.get(url)
-                page.raise_for_status()
-                success = True
-            except requests.exceptions.HTTPError:
-                sleep(delay)
-                delay *= 2
-                continue
-            except:
-                raise
-        if not success:
-            raise PVLiveException("Error communicating with the PV_Live API.")
+                page = self._session.get(url, params=params, headers=headers,
+                                         timeout=self.timeout, stream=stream)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                status = None
+            else:
+                if page.status_code < 400:
+                    break
+                status = page.status_code
+                page.close()
+            if try_counter == self.retries or not self._is_retryable(status):
+                raise PVLiveException("Error communicating with the PV_Live API.")
+            sleep(self._backoff(delay))
+            delay *= 2
+        if page.status_code == 304 and cached is not None:
+            page.close()
+            return self._copy_response(cached[2])
         try:
-            return json.loads(page.text)
+            if stream:
+                with closing(page):
+                    page.raw.decode_content = True
+                    response = dict(ijson.kvitems(page.raw, "", use_float=True))
+            elif orjson is not None:
+                response = orjson.loads(page.content)
+            else:
+                response = page.json()
         except:
             raise PVLiveException("Error communicating with the PV_Live API.")
+        etag = page.headers.get("ETag")
+        last_modified = page.headers.get("Last-Modified")
+        if conditional and (etag or last_modified):
+            self._etag_cache.put(cache_key, (etag, last_modified, response),
+                                 len(response.get("data", [])), self.etag_cache_size,
+                                 self.cache_max_rows)
+            return self._copy_response(response)
+        return response
+
+    async def _query_api_async(self, session, url, pes_id, params):
+        """Asynchronous counterpart of `_query_api()`, sharing its history and schema caches."""
+        cache_key = self._history_key(pes_id, params)
+        if cache_key is not None:
+            response = self._history_cache.get(cache_key)
+            if response is not None:
+                return self._copy_response(response)
+        response = await self._fetch_url_async(session, url, params)
+        if "meta" in response:
+            self._meta_cache.setdefault(params.get("extra_fields", ""), response["meta"])
+        if cache_key is not None:
+            self._cache_history(cache_key, response)
+            return self._copy_response(response)
+        return response
+
+    async def _fetch_url_async(self, session, url, params=None):
+        """
+        Fetch the URL with an asynchronous GET request, retrying with the same policy as
+        `_fetch_url()`.
+        """
+        delay = 1
+        for try_counter in range(self.retries + 1):
+            try:
+                async with session.get(url, params=params) as page:
+                    status = page.status
+                    if status < 400:
+                        try:
+                            return await page.json(content_type=None)
+                        except ValueError:
+                            raise PVLiveException("Error communicating with the PV_Live API.")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = None
+            if try_counter == self.retries or not self._is_retryable(status):
+                raise PVLiveException("Error communicating with the PV_Live API.")
+            await asyncio.sleep(self._backoff(delay))
+            delay *= 2
+
+    def _is_retryable(self, status):
+        """
+        Whether a failed request with this HTTP status code is worth retrying. A *status* of None
+        means the request timed out or could not connect, which is always retried.
+        """
+        # Client errors (other than rate limiting) will not succeed on retry
+        return status is None or status == 429 or status >= 500
+
+    def _backoff(self, delay):
+        """Apply the cap and random jitter to an exponential back-off delay (in seconds)."""
+        return min(self.max_delay, delay) * (1 + random.random() * 0.5)
+
+    def _is_aware_interval(self, start, end):
+        """Whether *start* and *end* are both timezone-aware datetime objects."""
+        if not (isinstance(start, datetime) and isinstance(end, datetime)):
+            return False
+        return start.tzinfo is not None and end.tzinfo is not None
+
+    def _chunk_ranges(self, start, end, pes_id):
+        """Split an interval into (start, end) pairs no longer than the API's maximum range."""
+        max_range = self.max_range["national"] if pes_id == 0 else self.max_range["regional"]
+        chunks = []
+        request_start = start
+        while request_start < end:
+            chunks.append((request_start, min(end, request_start + max_range)))
+            request_start += max_range + timedelta(minutes=30)
+        return chunks
 
     def _nearest_hh(self, dt):
         """Round a given datetime object up to the nearest half hour."""
-        if not(dt.minute % 30 == 0 and dt.second == 0 and dt.microsecond == 0):
-            dt = dt - timedelta(minutes=dt.minute%30, seconds=dt.second) + timedelta(minutes=30)
+        ts = int(dt.timestamp())
+        rem = ts % 1800
+        if rem or dt.microsecond:
+            dt = datetime.fromtimestamp(ts + 1800 - rem, tz=dt.tzinfo)
         return dt
 
+    def _nearest_hh_vec(self, times):
+        """Round an array of datetime64 values up to the nearest half hour."""
+        ns = np.asarray(times, dtype="datetime64[ns]").astype(np.int64)
+        step = 1800 * 10**9
+        return (-(-ns // step) * step).astype("datetime64[ns]")
+
 def main():
     """Demo the module's capabilities."""
     pvlive = PVLive()
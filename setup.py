@@ -58,13 +58,14 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        "Programming Language :: Python :: 2",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
     ],
 
     # What does your project relate to?
@@ -74,6 +75,9 @@ setup(
     # simple. Or you can use find_packages().
     packages=find_packages(exclude=["contrib", "docs", "tests"]),
 
+    # between_async() requires native coroutines and asyncio.run()
+    python_requires=">=3.7",
+
     # Alternatively, if you want to distribute just a my_module.py, uncomment
     # this:
     #   py_modules=["my_module"],
@@ -85,6 +89,7 @@ setup(
     install_requires=[
         "requests",
         "pytz",
+        "numpy",
     ],
 
     # List additional groups of dependencies here (e.g. development
@@ -92,7 +97,9 @@ setup(
     # for example:
     # $ pip install -e .[dev,test]
     extras_require={
-        
+        "async": ["aiohttp"],
+        "fast": ["orjson", "brotli"],
+        "stream": ["ijson>=3.1"],
     },
 
     # If there are data files included in your packages that need to be